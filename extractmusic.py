@@ -1,7 +1,9 @@
 # by strotlog 2024
 
 import collections
+import contextlib
 import hashlib
+import io
 import json
 import os
 import sys
@@ -35,11 +37,37 @@ def rom_read(rom, addr, length):
 def uint16at(bytearr, offset): # little endian
     return bytearr[offset] + bytearr[offset+1]*256
 
+def check_spc_read(spc_ram, addr, length, what):
+    # song set data from a corrupted or unusual hack can point or run anywhere. fail with a clear
+    # message rather than an IndexError (or worse, silently reading the next thing in ram)
+    if addr + length > len(spc_ram):
+        raise Exception(f"{what} runs past the end of the song set data (at SPC address {hex(addr)})")
+
 def spc_data_block(rom, header_fileaddr):
+    if header_fileaddr + 4 > len(rom):
+        raise Exception(f"SPC data block header at rom address {hex(header_fileaddr)} runs past the end of the rom")
     length = uint16at(rom, header_fileaddr)
     spc_dest = uint16at(rom, header_fileaddr+2)
+    if header_fileaddr + 4 + length > len(rom):
+        raise Exception(f"SPC data block at rom address {hex(header_fileaddr)} runs past the end of the rom")
     return (spc_dest, rom[(header_fileaddr+4) : (header_fileaddr+4+length)])
 
+def songset_error(songset_id, table_rom_addr, error): # -> record for the json's songsetErrors list
+    return collections.OrderedDict({"id": myhex(songset_id, 2), "snes": snes_addr_string_from_rom_offset(table_rom_addr), "error": str(error)})
+
+def is_song_set_table_entry(rom, table_rom_addr, songset_id):
+    # the one rule for where the song set table ends: song set ids are the music queue's 1 byte values,
+    # and each entry must be a 24 bit pointer into the rom. every other problem with a song set is an error
+    # in that song set, not the end of the table
+    if songset_id > 0xFF or table_rom_addr + 3 > len(rom):
+        return False
+    song_set_pointer_bytes = rom[table_rom_addr:(table_rom_addr+3)]
+    if song_set_pointer_bytes[2] < 0x80 or song_set_pointer_bytes[1] < 0x80:
+        return False
+    return rom_offset_from_snes_addr_string(myhex(song_set_pointer_bytes[2], 2) + ":" +
+                                            myhex(song_set_pointer_bytes[1], 2) +
+                                            myhex(song_set_pointer_bytes[0], 2)) < len(rom)
+
 def indentme(indent, string):
     # 2 spaces per level
     return (' ' * 2 * indent) + string
@@ -72,7 +100,8 @@ standard_song_sets = {
         0x48: "Tourian version of Crateria Outdoor with Power Bombs",
 }
 
-# commands with no special processing for now
+# commands with no special processing for now.
+# these are the vanilla lengths; the ones actually used come from the ROM's SPC engine (see spc_engine)
 g_simple_command_lengths = {
                      0xE0: 2,
                      0xE1: 2,
@@ -84,7 +113,7 @@ g_simple_command_lengths = {
                      0xE8: 3,
                      0xE9: 2,
                      0xEA: 2,
-                     0xEB: 3,
+                     0xEB: 4, # tremolo: delay, rate, depth
                      0xED: 2,
                      0xEE: 3,
                      0xF0: 2,
@@ -103,6 +132,13 @@ g_simple_command_lengths = {
                      # not really going to worry much about what happens with these last 4. could break if they do really occur
 }
 
+# limits on how far decoding may wander in malformed song set data before we give up on the song set.
+# vanilla voice sections and subsections are far shorter than this
+g_max_voice_bytes = 0x2000 # per voice section or subsection
+g_max_songset_commands = 0x20000 # per song set, counting every command scanned or decoded
+g_max_songset_pointers = 0x2000 # per song set, counting every song pointer and section pointer list entry
+g_max_songset_roll_ticks = 0x200000 # per song set, counting every voice's ticks with subsections and sections repeated (--pianoroll only)
+
 g_simple_end_commands = set({
     # interestingly, all of these commands are just 1 byte, and undo something set up by a command
     # whose byte is one less than these end (aka stop) bytes.
@@ -112,6 +148,66 @@ g_simple_end_commands = set({
     0xF6, # end static echo
 })
 
+# the engine reads its note tables from SPC RAM, where the "note length table" block loads them:
+# ring length table (8 bytes) at $5800, volume table (16 bytes) right after it
+g_ring_length_table_spc_addr = 0x5800
+g_volume_table_spc_addr = 0x5808
+# the SPC engine's table of parameter byte counts for commands 0xE0 through 0xFA. we find it by the
+# counts for 0xE0-0xEA, which are the same in vanilla and in every N-SPC engine we know of
+g_vanilla_command_param_counts_prefix = bytes([1, 1, 2, 3, 0, 1, 2, 1, 2, 1, 1])
+
+class spc_engine:
+    # what we need from a ROM's SPC engine (loaded at SPC 0x1500), read once per engine fingerprint (sha1)
+    def __init__(self, engine_block, sha1):
+        self.sha1 = sha1
+        param_counts_start = engine_block.find(g_vanilla_command_param_counts_prefix)
+        if param_counts_start < 0 or param_counts_start + (0xFA - 0xE0 + 1) > len(engine_block):
+            raise Exception(f"Unknown SPC engine (sha1 {self.sha1}): couldn't find its command length table")
+        if engine_block.find(g_vanilla_command_param_counts_prefix, param_counts_start + 1) >= 0:
+            raise Exception(f"Unknown SPC engine (sha1 {self.sha1}): found more than one possible command length table")
+        self.command_length_table_spc_addr = 0x1500 + param_counts_start
+        param_counts = engine_block[param_counts_start:(param_counts_start + 0xFA - 0xE0 + 1)]
+        # commands we decode specially must still have the parameters we expect, or we can't decode this engine
+        expected_special_param_counts = {0xE4: 0, 0xEC: 0, 0xEF: 3, 0xF3: 0, 0xF6: 0}
+        for command, count in expected_special_param_counts.items():
+            if param_counts[command - 0xE0] != count:
+                raise Exception(f"Unknown SPC engine (sha1 {self.sha1}): command {hex(command)} has " +
+                                f"{param_counts[command - 0xE0]} parameter bytes, expected {count}")
+        self.command_lengths = dict(g_simple_command_lengths) # 0xFB-0xFE aren't in the engine's table
+        for command in g_simple_command_lengths:
+            if command <= 0xFA:
+                self.command_lengths[command] = param_counts[command - 0xE0] + 1
+        # reported in the json, so that a vanilla ROM disagreeing with g_simple_command_lengths gets noticed
+        self.non_vanilla_command_lengths = collections.OrderedDict(
+            (myhex(command, 2), length) for (command, length) in self.command_lengths.items()
+            if length != g_simple_command_lengths[command])
+
+class spc_decoder:
+    # everything the track command decoder needs: the engine's command lengths, and the note tables
+    # in SPC RAM when a song set plays. one per (engine, note tables), shared by song sets that match
+    def __init__(self, engine, ring_length_table, volume_table):
+        self.engine = engine
+        self.command_lengths = engine.command_lengths
+        self.ring_length_table = ring_length_table
+        self.volume_table = volume_table
+
+g_max_songset_blocks = 0x40 # SPC data blocks per song set; vanilla has a handful
+
+def songset_spc_blocks(rom, table_rom_addr): # -> [(spc dest, block)] for every block the song set loads
+    song_set_pointer_bytes = rom[table_rom_addr:(table_rom_addr+3)]
+    block_fileaddr = rom_offset_from_snes_addr_string(myhex(song_set_pointer_bytes[2], 2) + ":" +
+                                                      myhex(song_set_pointer_bytes[1], 2) +
+                                                      myhex(song_set_pointer_bytes[0], 2))
+    blocks = []
+    while True:
+        (dest, block) = spc_data_block(rom, block_fileaddr)
+        if len(block) == 0:
+            return blocks # 0 length header (0000, 1500) ends the transfer
+        blocks.append((dest, block))
+        if len(blocks) > g_max_songset_blocks:
+            raise Exception(f"Song set has more than {g_max_songset_blocks} SPC data blocks")
+        block_fileaddr += 4 + len(block)
+
 class spc_state:
     volume = 0
     ring_length = 0
@@ -179,15 +275,104 @@ def dump_rest(spc_ram, addr, state):
     ret["properties"]["tic_length_seconds"] = state.tic_length_seconds
     return ret
 
-def address_tuple(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr):
+def rom_offset_from_spc_addr(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr):
     # TODO: comment how this math works
     if addr >= spc_start_addr:
-        romaddr = (addr - spc_start_addr) + rom_equiv_of_spc_start_addr
+        return (addr - spc_start_addr) + rom_equiv_of_spc_start_addr
     else:
-        romaddr = (addr - 0x1500) + spc_engine_begin_romaddr
+        return (addr - 0x1500) + spc_engine_begin_romaddr
+
+def address_tuple(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr):
+    romaddr = rom_offset_from_spc_addr(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)
     return collections.OrderedDict({"spcRam": hex(addr), "snes": snes_addr_string_from_rom_offset(romaddr), "rom": hex(romaddr)})
 
-def stateful_process_track_command(spc_ram, addr, state): # -> optional note json, length of command, opaque state object
+def piano_roll_sections(section_voices, voice_count, max_ticks): # -> (sections for piano_roll_arrays, ticks)
+    # section_voices is the song's sections in play order, repeats included. each section is a list of
+    # voices, and each voice is None (empty voice) or (entries, end_note_length_tics) as collected while
+    # decoding that voice section. an entry's tics is None when it plays with the note length carried in
+    # from the voice's previous section, and end_note_length_tics is None if the voice section never
+    # sets a note length. raises if the voices add up to more than max_ticks
+    note_length_tics = [spc_state.note_length_tics] * voice_count
+    sections = []
+    ticks = 0
+    for voices in section_voices:
+        section = []
+        for i, voice in enumerate(voices[:voice_count]):
+            if voice is None:
+                section.append(None)
+                continue
+            (entries, end_note_length_tics) = voice
+            ticks += sum(note_length_tics[i] if tics is None else tics for (_, tics, _) in entries)
+            if ticks > max_ticks:
+                raise Exception(f"Song set's piano roll is longer than {hex(g_max_songset_roll_ticks)} ticks")
+            section.append([(command, note_length_tics[i] if tics is None else tics, offset) for (command, tics, offset) in entries])
+            if end_note_length_tics is not None:
+                note_length_tics[i] = end_note_length_tics
+        sections.append(section)
+    return (sections, ticks)
+
+def piano_roll_arrays(sections, voice_count): # -> (roll, romaddrs), both numpy arrays of shape (voices, ticks)
+    # sections is the song's sections in play order. each section is a list of voices, and each voice is
+    # None (empty voice) or a list of (command byte, note_length_tics, rom offset) for every note, tie,
+    # rest and percussion note, in play order with subsections already expanded.
+    # roll cells hold the raw command byte held during that tick: 0x80-0xC7 pitch, 0xC8 tie,
+    # 0xC9 rest, 0xCA-0xDF percussion. 0 means the voice has no command of its own at that tick
+    # (it's empty in that section, or has already ended before the section did).
+    # romaddrs cells hold the rom offset of that command, or -1 where roll is 0.
+    # every voice in a section is padded or cut to the section's length, so a column is one moment in time.
+    # like the SPC engine, a section lasts as long as its first voice (first non-empty one, here)
+    section_lengths = []
+    for voices in sections:
+        first_voice = next((voice for voice in voices if voice is not None), [])
+        section_lengths.append(sum(tics for (_, tics, _) in first_voice))
+    roll = numpy.zeros((voice_count, sum(section_lengths)), dtype=numpy.uint8)
+    romaddrs = numpy.full((voice_count, sum(section_lengths)), -1, dtype=numpy.int32)
+    section_start = 0
+    for voices, section_length in zip(sections, section_lengths):
+        for i, voice in enumerate(voices[:voice_count]):
+            if voice is None or len(voice) == 0:
+                continue
+            (commands, tics, offsets) = (numpy.array(column) for column in zip(*voice))
+            voice_commands = numpy.repeat(commands, tics)[:section_length]
+            voice_end = section_start + len(voice_commands)
+            roll[i, section_start:voice_end] = voice_commands
+            romaddrs[i, section_start:voice_end] = numpy.repeat(offsets, tics)[:section_length]
+        section_start += section_length
+    return (roll, romaddrs)
+
+def track_command_length(spc_ram, addr, decoder, what): # -> length of the voice command at addr
+    # lightly parse the command, making sure all of it (not just the opcode) is within the song set data
+    check_spc_read(spc_ram, addr, 1, what)
+    command_length = 1
+    if spc_ram[addr] >= 1 and spc_ram[addr] < 0x80:
+        # set note length, also read next byte to know if it's part of this command
+        check_spc_read(spc_ram, addr, 2, what)
+        if spc_ram[addr+1] < 0x80:
+            command_length = 2
+    elif spc_ram[addr] >= 0x80 and spc_ram[addr] < 0xC8: # play a note
+        a = 0 # no-op
+    elif spc_ram[addr] >= 0xCA and spc_ram[addr] < 0xE0: # percussion note
+        a = 0 # no-op
+    elif spc_ram[addr] == 0xC8: # tie
+        a = 0 # no-op
+    elif spc_ram[addr] == 0xC9: # rest
+        a = 0 # no-op
+    elif spc_ram[addr] == 0xEF: # play subsection
+        command_length = 4
+    elif spc_ram[addr] == 0xFF:
+        raise Exception("Unknown voice command 0xFF")
+    elif spc_ram[addr] in decoder.command_lengths:
+        command_length = decoder.command_lengths[spc_ram[addr]]
+    elif spc_ram[addr] in g_simple_end_commands:
+        command_length = 1
+    elif spc_ram[addr] == 0xF3: # end slide (probably doesn't affect "pitch slide" aka command 0xF9, though)
+        command_length = 1
+    else:
+        raise Exception(f"Code error: byte value {hex(spc_ram[addr])} is not handled")
+    check_spc_read(spc_ram, addr, command_length, what)
+    return command_length
+
+def stateful_process_track_command(spc_ram, addr, state, decoder): # -> optional note json, length of command, opaque state object
     if spc_ram[addr] == 0xEF:
         raise Exception("implementation error: caller must process repeated subsections") # but not any other commands
     if state is None:
@@ -199,10 +384,8 @@ def stateful_process_track_command(spc_ram, addr, state): # -> optional note jso
         # if it is, it sets volume and ring length, too
         state.note_length_tics = spc_ram[addr]
         if spc_ram[addr+1] < 0x80:
-            ring_length_table = [0x32, 0x65, 0x7f, 0x98, 0xb2, 0xcb, 0xe5, 0xfc] # maybe could extract this from global spc ram rather than hard coding?
-            volume_table = [0x19, 0x32, 0x4c, 0x65, 0x72, 0x7f, 0x9c, 0x98, 0xa5, 0xb2, 0xbf, 0xcb, 0xd8, 0xe5, 0xf2, 0xfc]
-            state.ring_length = ring_length_table[(spc_ram[addr+1] & 0x70) >> 4]
-            state.volume = volume_table[spc_ram[addr+1] & 0x0f]
+            state.ring_length = decoder.ring_length_table[(spc_ram[addr+1] & 0x70) >> 4]
+            state.volume = decoder.volume_table[spc_ram[addr+1] & 0x0f]
             command_length = 2
     # TODO: can we detect playing of samples? or more importantly, any instruments that get played as notes when actually other pitches mean other instruments. does that happen in sm? thunder?
     elif spc_ram[addr] >= 0x80 and spc_ram[addr] < 0xC8: # play a note!
@@ -217,8 +400,8 @@ def stateful_process_track_command(spc_ram, addr, state): # -> optional note jso
         command_length = 4
     elif spc_ram[addr] == 0xFF:
         raise Exception("Unknown voice command 0xFF")
-    elif spc_ram[addr] in g_simple_command_lengths:
-        command_length = g_simple_command_lengths[spc_ram[addr]]
+    elif spc_ram[addr] in decoder.command_lengths:
+        command_length = decoder.command_lengths[spc_ram[addr]]
     elif spc_ram[addr] in g_simple_end_commands:
         command_length = 1
     elif spc_ram[addr] == 0xF3: # end slide
@@ -227,7 +410,7 @@ def stateful_process_track_command(spc_ram, addr, state): # -> optional note jso
         raise Exception(f"Code error: byte value {hex(spc_ram[addr])} is not handled")
 
     # track the state
-    if spc_ram[addr] in g_simple_command_lengths:
+    if spc_ram[addr] in decoder.command_lengths:
         # if parameter to the command is just 1 byte long, save it as a single byte (non-array)
         # otherwise, save the params as an array of 0, or 2, or 3, ... etc length of bytes
         if command_length == 2:
@@ -256,6 +439,20 @@ if len(sys.argv) < 2:
     print("Error: Must specify a ROM file")
     exit(1)
 
+# optional: also export every song as a dense piano roll (voices x ticks) to a numpy .npz file
+pianoroll_filename = None
+if len(sys.argv) >= 3:
+    if sys.argv[2] != "--pianoroll" or len(sys.argv) != 4:
+        print("Error: Usage: extractmusic.py ROMFILE [--pianoroll OUTFILE.npz]")
+        exit(1)
+    pianoroll_filename = sys.argv[3]
+    try:
+        import numpy
+    except ImportError:
+        print("Error: --pianoroll requires numpy")
+        exit(1)
+pianorolls = collections.OrderedDict()
+
 file = open(sys.argv[1], "rb")
 rombytes = file.read()
 filenameonly = os.path.basename(sys.argv[1])
@@ -280,6 +477,20 @@ table_addr = myhex(table_addr_bytes[2], 2) + ":" + myhex(table_addr_bytes[1], 2)
 # print(f"Debug: Detected music pointer table at ${table_addr}")
 current_table_rom_addr = rom_offset_from_snes_addr_string(table_addr)
 
+# read the SPC engine (loaded by the first song set) once, before any output, so an unknown engine
+# doesn't leave broken json behind. song sets that load an engine again reuse this unless it differs
+spc_engines_by_sha1 = {} # engine block sha1 -> spc_engine
+try:
+    engine_block = next((block for (dest, block) in songset_spc_blocks(rombytes, current_table_rom_addr) if dest == 0x1500), None)
+    if engine_block is None:
+        raise Exception("First song set doesn't load an SPC engine")
+    engine_sha1 = hashlib.sha1(engine_block).hexdigest()
+    engine = spc_engine(engine_block, engine_sha1)
+    spc_engines_by_sha1[engine_sha1] = engine
+except Exception as e:
+    print(f"Error: {e}")
+    exit(1)
+
 # 3 address spaces:
 # SPC RAM: 0x5957
 # SNES A-bus $CF:be0d
@@ -289,9 +500,19 @@ current_table_rom_addr = rom_offset_from_snes_addr_string(table_addr)
 print("{")
 print(f'"romname": "{filenameonly}",')
 print(f'"romsha1hash": "{filesha1}",')
+print(f'"spcEngine": {{"sha1": "{engine.sha1}", "commandLengthTableSpcAddr": "{hex(engine.command_length_table_spc_addr)}", ' +
+      f'"nonVanillaCommandLengths": {json.dumps(engine.non_vanilla_command_lengths)}}},')
+
+# what SPC RAM holds from the song sets loaded so far, for reading the note tables. like the real
+# SPC RAM, it persists from one song set to the next
+spc_loaded_ram = bytearray(0x10000)
+spc_loaded_mask = bytearray(0x10000) # 1 where some song set has loaded a byte
+spc_decoders = {} # (engine sha1, note tables) -> spc_decoder
 print(f'"songsets": [')
 indent = 1
 
+any_songset_printed = False
+songset_errors = [] # song sets that were skipped because their data couldn't be decoded
 is_valid_music = True
 while is_valid_music: # loop over song sets
     # develop a hierarchical structure for the data before we can start processing actual music commands
@@ -307,10 +528,11 @@ while is_valid_music: # loop over song sets
     # set of voice end boundaries (== set of voice start pointers)
     voice_end_boundaries = set()
 
-    song_set_pointer_bytes = rombytes[current_table_rom_addr:(current_table_rom_addr+3)]
-    if song_set_pointer_bytes[2] < 0x80 or song_set_pointer_bytes[1] < 0x80:
+    songset_id = current_table_rom_addr - rom_offset_from_snes_addr_string(table_addr)
+    if not is_song_set_table_entry(rombytes, current_table_rom_addr, songset_id):
         is_valid_music = False
         break
+    song_set_pointer_bytes = rombytes[current_table_rom_addr:(current_table_rom_addr+3)]
     current_block_fileaddr = rom_offset_from_snes_addr_string(myhex(song_set_pointer_bytes[2], 2) + ":" +
                                                               myhex(song_set_pointer_bytes[1], 2) +
                                                               myhex(song_set_pointer_bytes[0], 2))
@@ -328,6 +550,10 @@ while is_valid_music: # loop over song sets
                 # processing to extract the global tracks
                 spc_global_ram = bytes(0x1500) + block
                 spc_engine_begin_romaddr = current_block_fileaddr+4
+                engine_sha1 = hashlib.sha1(block).hexdigest()
+                if engine_sha1 not in spc_engines_by_sha1:
+                    spc_engines_by_sha1[engine_sha1] = spc_engine(block, engine_sha1)
+                engine = spc_engines_by_sha1[engine_sha1]
             if dest == 0x5820:
                 # this 'song set pointer' actually includes the main song pointer list, including
                 # the only time we see the global songs' pointers into spc_global_ram
@@ -339,257 +565,355 @@ while is_valid_music: # loop over song sets
             current_block_fileaddr += 4 + len(block)
         # read 5th block (typical case)
         (spc_start_addr, block) = spc_data_block(rombytes, current_block_fileaddr)
-    except:
-        raise
-        print("Debug: Found invaild song set via some exception. Done.")
-        is_valid_music = False
-        break
+
+        # load everything this song set loads, then read the note tables from where the engine reads them
+        for (dest, loaded_block) in songset_spc_blocks(rombytes, current_table_rom_addr):
+            loaded_end = min(dest + len(loaded_block), len(spc_loaded_ram))
+            spc_loaded_ram[dest:loaded_end] = loaded_block[:(loaded_end - dest)]
+            spc_loaded_mask[dest:loaded_end] = bytes([1]) * (loaded_end - dest)
+        if not all(spc_loaded_mask[g_ring_length_table_spc_addr:(g_ring_length_table_spc_addr+8)]) or \
+           not all(spc_loaded_mask[g_volume_table_spc_addr:(g_volume_table_spc_addr+16)]):
+            raise Exception("Neither this song set nor an earlier one loads the note ring length/volume tables " +
+                            f"(SPC address {hex(g_ring_length_table_spc_addr)})")
+        ring_length_table = list(spc_loaded_ram[g_ring_length_table_spc_addr:(g_ring_length_table_spc_addr+8)])
+        volume_table = list(spc_loaded_ram[g_volume_table_spc_addr:(g_volume_table_spc_addr+16)])
+        decoder_key = (engine.sha1, bytes(ring_length_table + volume_table))
+        if decoder_key not in spc_decoders:
+            spc_decoders[decoder_key] = spc_decoder(engine, ring_length_table, volume_table)
+        decoder = spc_decoders[decoder_key]
+    except Exception as e:
+        songset_errors.append(songset_error(songset_id, current_table_rom_addr, e))
+        current_table_rom_addr += 3 # move to next song set
+        continue
 
     if len(spc_global_ram) > 0 and len(spc_initial_song_pointers) > 0:
         # special construction of ram. there should be global songs and song set specific
         # songs (even if duplicative) in this data
         spc_start_addr = 0x5820
         if spc_start_addr < len(spc_global_ram):
-            print("Error: Not implemented: SPC engine overlaps beginning of changeable songs area") # would need new math
-            is_valid_music = False
-            break
+            # would need new math
+            songset_errors.append(songset_error(songset_id, current_table_rom_addr, "Not implemented: SPC engine overlaps beginning of changeable songs area"))
+            current_table_rom_addr += 3 # move to next song set
+            continue
         spc_ram = spc_global_ram + bytes(spc_start_addr - len(spc_global_ram)) + block
     else:
         # normal case (all song sets except for song set 0)
         rom_equiv_of_spc_start_addr = current_block_fileaddr + 4
         current_block_fileaddr += (4 + len(block))
         if rombytes[current_block_fileaddr:(current_block_fileaddr+4)] != b"\x00\x00\x00\x15":
-            # print(f"Debug: SPC block at reversed 24 bit SNES pointer {song_set_pointer_bytes} did not match " +
-            #       f"expected terminator 0000, 1500 at detected end (rom addr {hex(current_block_fileaddr)})")
-            is_valid_music = False
-            break
+            songset_errors.append(songset_error(songset_id, current_table_rom_addr,
+                                                f"SPC data did not end with the expected terminator 0000, 1500 (at rom address {hex(current_block_fileaddr)})"))
+            current_table_rom_addr += 3 # move to next song set
+            continue
         # simulate SPC ram so we can access it without using offsets
         # (still, ideally access only the area which is within this song set)
         spc_ram = bytes(spc_start_addr) + block
 
-    is_a_song_pointer = True
-    songset_song_section_voice = collections.OrderedDict()
-    spc_address_of_next_pointer_to_a_song = spc_start_addr
-    while is_a_song_pointer:
-        if spc_address_of_next_pointer_to_a_song in songset_song_section_voice:
-            # this address doesn't have a song pointer, the only only way we know is that it's pointed
-            # to by an already-seen song pointer
-            is_a_song_pointer = False
-            break
-        songset_song_section_voice[uint16at(spc_ram, spc_address_of_next_pointer_to_a_song)] = \
-            collections.OrderedDict()
-        spc_address_of_next_pointer_to_a_song += 2
-
-    for song_ptr, _ in songset_song_section_voice.items(): # loop over songs (in the song set)
-        spc_address_of_next_pointer_to_a_sectioncommand = song_ptr
-        while uint16at(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand) != 0:
-            section_pointer = uint16at(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand)
-            if section_pointer == 0x00ff:
-                spc_address_of_next_pointer_to_a_sectioncommand += 4 # skip processing loop point
-            else:
-                songset_song_section_voice[song_ptr][section_pointer] = collections.OrderedDict()
-                spc_address_of_next_pointer_to_a_sectioncommand+=2
-
-        for song_section, _ in songset_song_section_voice[song_ptr].items():
-            # each song section has 1-8 voices, which will each in turn have a list of music commands
-            spc_address_of_next_voice = song_section
-            for i in range(8):
-                voice_start_ptr = uint16at(spc_ram, spc_address_of_next_voice)
-                if voice_start_ptr == 0:
-                    songset_song_section_voice[song_ptr][song_section]["0000-v#" + str(i)] = None
-                else:
-                    songset_song_section_voice[song_ptr][song_section][voice_start_ptr] = {"end_spc_ptr": None}
-                    voice_end_boundaries.add(voice_start_ptr)
-                spc_address_of_next_voice += 2
-
-    # TODO: update comment
-    # now we have completed, for the song set: all song pointers (top level)
-    #                                          all section pointers (mid level pointed to by song pointers)
-    #                                          all voice pointers (bottom level pointed to by section pointers)
-    # in a breadth-first way, we've also taken stock of where all the voices start. why?
-    # these are the only ways we'll know where a voice command list ends:
-    # 1) a 00 command is encountered,
-    # 2) the command list runs right into a different command list, OR
-    # 3) the command list runs into another song's beginning
-    # (detection of all 3 is required!)
-
-    # processing voices!
-    for song_ptr, _ in songset_song_section_voice.items():
-        for song_section, _ in songset_song_section_voice[song_ptr].items():
-            for voice_start_ptr, _ in songset_song_section_voice[song_ptr][song_section].items():
-                if isinstance(voice_start_ptr, str) and voice_start_ptr[0:4] == "0000":
-                    continue # empty voice
-                addr = voice_start_ptr
-                # find the end of this voice section by lightly parsing the voice section's commands
-                while spc_ram[addr] != 0 and \
-                      (addr == voice_start_ptr or addr not in voice_end_boundaries) and \
-                      addr not in songset_song_section_voice:
-                    command_length = 1
-                    if spc_ram[addr] >= 1 and spc_ram[addr] < 0x80:
-                        # set note length, also read next byte to know if it's part of this command
-                        if spc_ram[addr+1] < 0x80:
-                            command_length = 2
-                    elif spc_ram[addr] >= 0x80 and spc_ram[addr] < 0xC8: # play a note
-                        a = 0 # no-op
-                    elif spc_ram[addr] >= 0xCA and spc_ram[addr] < 0xE0: # percussion note
-                        a = 0 # no-op
-                    elif spc_ram[addr] == 0xC8: # tie
-                        a = 0 # no-op
-                    elif spc_ram[addr] == 0xC9: # rest
-                        a = 0 # no-op
-                    elif spc_ram[addr] == 0xEF: # play subsection
-                        command_length = 4
-                    elif spc_ram[addr] == 0xFF:
-                        raise Exception("Unknown voice command 0xFF")
-                    elif spc_ram[addr] in g_simple_command_lengths:
-                        command_length = g_simple_command_lengths[spc_ram[addr]]
-                    elif spc_ram[addr] in g_simple_end_commands:
-                        command_length = 1
-                    elif spc_ram[addr] == 0xF3: # end slide (probably doesn't affect "pitch slide" aka command 0xF9, though)
-                        command_length = 1
-                    else:
-                        raise Exception(f"Code error: byte value {hex(spc_ram[addr])} is not handled")
-                    addr += command_length
-                # record the spc address of end of this voice section
-                songset_song_section_voice[song_ptr][song_section][voice_start_ptr]["end_spc_ptr"] = addr
-
-    # reorganize
-    # FROM song -> section -> voice
-    #  TO  song -> voice -> section
-    reorganized = collections.OrderedDict()
-    for song_ptr, _ in songset_song_section_voice.items():
-        used_voices = [False, False, False, False, False, False, False, False]
-        for song_section, _ in songset_song_section_voice[song_ptr].items():
-            used_voices_this_section = [str(vp)[0:4] != "0000" for vp in songset_song_section_voice[song_ptr][song_section].keys()]
-            used_voices = [value or used_voices_this_section[i] for (i, value) in enumerate(used_voices)]
-        max_voices = 8
-        for i, voice_is_used in reversed(list(enumerate(used_voices))):
-            if not voice_is_used:
-                max_voices-=1
-            else:
-                break # this is the rightmost voice that gets used in the song, preserve any unused voices to its left(unlikely, but possible)
-        # song is an array of voices, each has/is 1 OrderedDict representing the voice's sections by voice section pointer
-        reorganized[song_ptr] = [collections.OrderedDict() for _ in range(max_voices)]
-        for song_section, _ in songset_song_section_voice[song_ptr].items():
-            for i, (voice_start_pointer, _) in enumerate(songset_song_section_voice[song_ptr][song_section].items()):
-                if i >= max_voices: # guaranteed to be nulls anyway
+    # decode and print this song set into a buffer, so that a malformed song set can be skipped
+    # without leaving partial json behind
+    songset_output = io.StringIO()
+    songset_pianorolls = collections.OrderedDict()
+    songset_commands = 0 # commands decoded so far in this song set, limited by g_max_songset_commands
+    songset_pointers = 0 # song/section pointer list entries read so far in this song set, limited by g_max_songset_pointers
+    songset_roll_entries = 0 # piano roll notes collected so far in this song set. each is at least 1 tick, so
+                             # this is also limited by g_max_songset_roll_ticks
+    songset_roll_ticks = 0 # piano roll ticks laid out so far in this song set, limited by g_max_songset_roll_ticks
+    try:
+        with contextlib.redirect_stdout(songset_output):
+            is_a_song_pointer = True
+            songset_song_section_voice = collections.OrderedDict()
+            songset_song_section_order = collections.OrderedDict() # song ptr -> section ptrs in play order, repeats included
+            spc_address_of_next_pointer_to_a_song = spc_start_addr
+            while is_a_song_pointer:
+                if spc_address_of_next_pointer_to_a_song in songset_song_section_voice:
+                    # this address doesn't have a song pointer, the only only way we know is that it's pointed
+                    # to by an already-seen song pointer
+                    is_a_song_pointer = False
                     break
-                # in "reorganized", this "voice_start_pointer" really means "voice_section_start_ptr". i.e., where the note etc. commands are
-                reorganized[song_ptr][i][voice_start_pointer] = songset_song_section_voice[song_ptr][song_section][voice_start_pointer]
-
-        #print(json.dumps(reorganized))
-
-    songset_id = current_table_rom_addr - rom_offset_from_snes_addr_string(table_addr)
-    if songset_id != 0:
-        print(indentme(indent, "},")) # end previous song set w/ comma if this isn't the first one
-    print(indentme(indent, "{")) # for song set
-    indent += 1
-    print(indentme(indent, f'"id": "{myhex(songset_id, 2)}",')) # 00, 03, 06, ..., 0C, ... etc.
-    if songset_id in standard_song_sets:
-        # TODO more heuristics to make sure it's the real song set?
-        print(indentme(indent, f'"vanillaMatchingSongSetName": "{standard_song_sets[songset_id]}",'))
-    print(indentme(indent, '"songs": ['))
-    indent += 1
-
-
-    for song_index, (song_ptr, _) in enumerate(reorganized.items()):
-        if song_index != 0:
-            print(indentme(indent, "},")) # end previous song w/ comma if this isn't the first one
-        print(indentme(indent, "{"))
-        indent += 1
-        song_id = song_index + 5 if song_ptr > 0x5820 else song_index
-        print(indentme(indent, f'"id": "{myhex(song_id, 2)}",'))
-        print(indentme(indent, '"voices": ['))
-        indent += 1
-        for (i, _) in enumerate(reorganized[song_ptr]):
-            # init a new voice
-            if i != 0:
-                print(indentme(indent, "},")) # end previous voice w/ comma if this isn't the first one
-            print(indentme(indent, "{"))
+                check_spc_read(spc_ram, spc_address_of_next_pointer_to_a_song, 2, "Song pointer list")
+                songset_pointers += 1
+                if songset_pointers > g_max_songset_pointers:
+                    raise Exception(f"Song set has more than {hex(g_max_songset_pointers)} song and section pointers")
+                songset_song_section_voice[uint16at(spc_ram, spc_address_of_next_pointer_to_a_song)] = \
+                    collections.OrderedDict()
+                spc_address_of_next_pointer_to_a_song += 2
+
+            for song_ptr, _ in songset_song_section_voice.items(): # loop over songs (in the song set)
+                spc_address_of_next_pointer_to_a_sectioncommand = song_ptr
+                songset_song_section_order[song_ptr] = []
+                check_spc_read(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand, 2, f"Song at SPC address {hex(song_ptr)}")
+                while uint16at(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand) != 0:
+                    section_pointer = uint16at(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand)
+                    if section_pointer == 0x00ff:
+                        spc_address_of_next_pointer_to_a_sectioncommand += 4 # skip processing loop point
+                    else:
+                        songset_song_section_voice[song_ptr][section_pointer] = collections.OrderedDict()
+                        songset_song_section_order[song_ptr].append(section_pointer)
+                        spc_address_of_next_pointer_to_a_sectioncommand+=2
+                    songset_pointers += 1
+                    if songset_pointers > g_max_songset_pointers:
+                        raise Exception(f"Song set has more than {hex(g_max_songset_pointers)} song and section pointers")
+                    check_spc_read(spc_ram, spc_address_of_next_pointer_to_a_sectioncommand, 2, f"Song at SPC address {hex(song_ptr)}")
+
+                for song_section, _ in songset_song_section_voice[song_ptr].items():
+                    # each song section has 1-8 voices, which will each in turn have a list of music commands
+                    spc_address_of_next_voice = song_section
+                    check_spc_read(spc_ram, song_section, 16, "Song section voice pointers")
+                    for i in range(8):
+                        voice_start_ptr = uint16at(spc_ram, spc_address_of_next_voice)
+                        if voice_start_ptr == 0:
+                            songset_song_section_voice[song_ptr][song_section]["0000-v#" + str(i)] = None
+                        else:
+                            songset_song_section_voice[song_ptr][song_section][voice_start_ptr] = {"end_spc_ptr": None}
+                            voice_end_boundaries.add(voice_start_ptr)
+                        spc_address_of_next_voice += 2
+
+            # TODO: update comment
+            # now we have completed, for the song set: all song pointers (top level)
+            #                                          all section pointers (mid level pointed to by song pointers)
+            #                                          all voice pointers (bottom level pointed to by section pointers)
+            # in a breadth-first way, we've also taken stock of where all the voices start. why?
+            # these are the only ways we'll know where a voice command list ends:
+            # 1) a 00 command is encountered,
+            # 2) the command list runs right into a different command list, OR
+            # 3) the command list runs into another song's beginning
+            # (detection of all 3 is required!)
+
+            # processing voices!
+            for song_ptr, _ in songset_song_section_voice.items():
+                for song_section, _ in songset_song_section_voice[song_ptr].items():
+                    for voice_start_ptr, _ in songset_song_section_voice[song_ptr][song_section].items():
+                        if isinstance(voice_start_ptr, str) and voice_start_ptr[0:4] == "0000":
+                            continue # empty voice
+                        addr = voice_start_ptr
+                        check_spc_read(spc_ram, addr, 1, f"Voice at SPC address {hex(voice_start_ptr)}")
+                        # find the end of this voice section by lightly parsing the voice section's commands
+                        while spc_ram[addr] != 0 and \
+                              (addr == voice_start_ptr or addr not in voice_end_boundaries) and \
+                              addr not in songset_song_section_voice:
+                            command_length = track_command_length(spc_ram, addr, decoder, f"Voice at SPC address {hex(voice_start_ptr)}")
+                            addr += command_length
+                            songset_commands += 1
+                            if addr - voice_start_ptr > g_max_voice_bytes:
+                                raise Exception(f"Voice at SPC address {hex(voice_start_ptr)} is longer than {hex(g_max_voice_bytes)} bytes")
+                            if songset_commands > g_max_songset_commands:
+                                raise Exception(f"Song set has more than {g_max_songset_commands} commands")
+                            check_spc_read(spc_ram, addr, 1, f"Voice at SPC address {hex(voice_start_ptr)}")
+                        # record the spc address of end of this voice section
+                        songset_song_section_voice[song_ptr][song_section][voice_start_ptr]["end_spc_ptr"] = addr
+
+            # reorganize
+            # FROM song -> section -> voice
+            #  TO  song -> voice -> section
+            reorganized = collections.OrderedDict()
+            for song_ptr, _ in songset_song_section_voice.items():
+                used_voices = [False, False, False, False, False, False, False, False]
+                for song_section, _ in songset_song_section_voice[song_ptr].items():
+                    used_voices_this_section = [str(vp)[0:4] != "0000" for vp in songset_song_section_voice[song_ptr][song_section].keys()]
+                    used_voices = [value or used_voices_this_section[i] for (i, value) in enumerate(used_voices)]
+                max_voices = 8
+                for i, voice_is_used in reversed(list(enumerate(used_voices))):
+                    if not voice_is_used:
+                        max_voices-=1
+                    else:
+                        break # this is the rightmost voice that gets used in the song, preserve any unused voices to its left(unlikely, but possible)
+                # song is an array of voices, each has/is 1 OrderedDict representing the voice's sections by voice section pointer
+                reorganized[song_ptr] = [collections.OrderedDict() for _ in range(max_voices)]
+                for song_section, _ in songset_song_section_voice[song_ptr].items():
+                    for i, (voice_start_pointer, _) in enumerate(songset_song_section_voice[song_ptr][song_section].items()):
+                        if i >= max_voices: # guaranteed to be nulls anyway
+                            break
+                        # in "reorganized", this "voice_start_pointer" really means "voice_section_start_ptr". i.e., where the note etc. commands are
+                        reorganized[song_ptr][i][voice_start_pointer] = songset_song_section_voice[song_ptr][song_section][voice_start_pointer]
+
+                #print(json.dumps(reorganized))
+
+            if any_songset_printed:
+                print(indentme(indent, "},")) # end previous song set w/ comma if this isn't the first one
+            print(indentme(indent, "{")) # for song set
             indent += 1
-            print(indentme(indent, f'"id": {i},'))
-            print(indentme(indent, '"sections": ['))
+            print(indentme(indent, f'"id": "{myhex(songset_id, 2)}",')) # 00, 03, 06, ..., 0C, ... etc.
+            print(indentme(indent, f'"noteTables": {{"ringLength": {json.dumps(decoder.ring_length_table)}, "volume": {json.dumps(decoder.volume_table)}}},'))
+            if songset_id in standard_song_sets:
+                # TODO more heuristics to make sure it's the real song set?
+                print(indentme(indent, f'"vanillaMatchingSongSetName": "{standard_song_sets[songset_id]}",'))
+            print(indentme(indent, '"songs": ['))
             indent += 1
 
-            state = None
 
-            for section_index, (voice_section_start_ptr, _) in enumerate(reorganized[song_ptr][i].items()):
-                if section_index != 0:
-                    print(indentme(indent, "},")) # end previous section w/ comma if this isn't the first one
+            for song_index, (song_ptr, _) in enumerate(reorganized.items()):
+                if song_index != 0:
+                    print(indentme(indent, "},")) # end previous song w/ comma if this isn't the first one
                 print(indentme(indent, "{"))
-                if isinstance(voice_section_start_ptr, str) and voice_section_start_ptr[0:4] == "0000":
-                    indent += 1
-                    print(indentme(indent, '"empty": true'))
-                    indent -= 1
-                    continue # empty voice
-
                 indent += 1
-                print(indentme(indent, f'"sectionId": "song{myhex(songset_id, 2)}{myhex(song_id, 2)}voice{i}section{section_index}",'))
-                print(indentme(indent, '"notes": ['))
+                song_id = song_index + 5 if song_ptr > 0x5820 else song_index
+                print(indentme(indent, f'"id": "{myhex(song_id, 2)}",'))
+                print(indentme(indent, '"voices": ['))
                 indent += 1
+                roll_voice_sections = {} # (voice index, voice section start ptr) -> (entries, end note length), see piano_roll_sections
+                for (i, _) in enumerate(reorganized[song_ptr]):
+                    # init a new voice
+                    if i != 0:
+                        print(indentme(indent, "},")) # end previous voice w/ comma if this isn't the first one
+                    print(indentme(indent, "{"))
+                    indent += 1
+                    print(indentme(indent, f'"id": {i},'))
+                    print(indentme(indent, '"sections": ['))
+                    indent += 1
 
-                addr = voice_section_start_ptr
-                wehaveSuppressedFirstComma = False
-                while addr < reorganized[song_ptr][i][voice_section_start_ptr]["end_spc_ptr"]:
-                    if spc_ram[addr] == 0xEF:
-                        # special case: command is "play repeated subsection"
-                        subsection_addr = spc_ram[addr+1] + 256*spc_ram[addr+2]
-                        if wehaveSuppressedFirstComma:
-                            print(',')
-                        else:
-                            wehaveSuppressedFirstComma = True
-                        print(indentme(indent, '{ "subsection": { "notes": ['))
+                    state = None
+
+                    for section_index, (voice_section_start_ptr, _) in enumerate(reorganized[song_ptr][i].items()):
+                        if section_index != 0:
+                            print(indentme(indent, "},")) # end previous section w/ comma if this isn't the first one
+                        print(indentme(indent, "{"))
+                        if isinstance(voice_section_start_ptr, str) and voice_section_start_ptr[0:4] == "0000":
+                            indent += 1
+                            print(indentme(indent, '"empty": true'))
+                            indent -= 1
+                            continue # empty voice
+
+                        roll_voice_section = [] # (command byte, tics or None if carried in, rom offset)
+                        roll_note_length_tics = None # note length set within this voice section so far
+                        indent += 1
+                        print(indentme(indent, f'"sectionId": "song{myhex(songset_id, 2)}{myhex(song_id, 2)}voice{i}section{section_index}",'))
+                        print(indentme(indent, '"notes": ['))
                         indent += 1
-                        wehaveSuppressedFirstCommaForSubsection = False
-                        while spc_ram[subsection_addr] != 0: # subsections must be 0-terminated
-                            (kindaJson, length, state) = stateful_process_track_command(spc_ram, subsection_addr, state)
-                            if kindaJson is not None and "note" in kindaJson:
-                                kindaJson["address"] = address_tuple(subsection_addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)
-                                if wehaveSuppressedFirstCommaForSubsection:
-                                    print(", ")
+
+                        addr = voice_section_start_ptr
+                        wehaveSuppressedFirstComma = False
+                        while addr < reorganized[song_ptr][i][voice_section_start_ptr]["end_spc_ptr"]:
+                            if spc_ram[addr] == 0xEF:
+                                # special case: command is "play repeated subsection"
+                                subsection_addr = spc_ram[addr+1] + 256*spc_ram[addr+2]
+                                if wehaveSuppressedFirstComma:
+                                    print(',')
                                 else:
-                                    wehaveSuppressedFirstCommaForSubsection = True
-                                print(indentme(indent, json.dumps(kindaJson)), end='') # no newline, wait an dsee if comma is needed
-                            subsection_addr += length
-                            firstSubsectionNote = False
-                        addr += 4
-                        indent -= 1
-                        print('') # newline after last subsection note
-                        print(indentme(indent, "]}}"), end='') # end subsection, no newline, wait and see if comma is needed
-                    else:
-                        # general case
-                        (kindaJson, length, state) = stateful_process_track_command(spc_ram, addr, state)
-                        if kindaJson is not None and "note" in kindaJson:
-                            kindaJson["address"] = address_tuple(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)
-                            if wehaveSuppressedFirstComma:
-                                print(',')
+                                    wehaveSuppressedFirstComma = True
+                                print(indentme(indent, '{ "subsection": { "notes": ['))
+                                indent += 1
+                                wehaveSuppressedFirstCommaForSubsection = False
+                                roll_subsection = []
+                                roll_subsection_carried_in = 0 # notes before the subsection sets its own note length
+                                roll_subsection_sets_length = False
+                                subsection_start_addr = subsection_addr
+                                check_spc_read(spc_ram, subsection_addr, 1, f"Subsection at SPC address {hex(subsection_start_addr)}")
+                                while spc_ram[subsection_addr] != 0: # subsections must be 0-terminated
+                                    track_command_length(spc_ram, subsection_addr, decoder, f"Subsection at SPC address {hex(subsection_start_addr)}")
+                                    (kindaJson, length, state) = stateful_process_track_command(spc_ram, subsection_addr, state, decoder)
+                                    if pianoroll_filename is not None:
+                                        if spc_ram[subsection_addr] >= 1 and spc_ram[subsection_addr] < 0x80:
+                                            roll_note_length_tics = spc_ram[subsection_addr]
+                                            roll_subsection_sets_length = True
+                                        elif kindaJson is not None:
+                                            if not roll_subsection_sets_length:
+                                                roll_subsection_carried_in += 1
+                                            roll_subsection.append((spc_ram[subsection_addr], roll_note_length_tics,
+                                                                    rom_offset_from_spc_addr(subsection_addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)))
+                                    if kindaJson is not None and "note" in kindaJson:
+                                        kindaJson["address"] = address_tuple(subsection_addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)
+                                        if wehaveSuppressedFirstCommaForSubsection:
+                                            print(", ")
+                                        else:
+                                            wehaveSuppressedFirstCommaForSubsection = True
+                                        print(indentme(indent, json.dumps(kindaJson)), end='') # no newline, wait an dsee if comma is needed
+                                    subsection_addr += length
+                                    songset_commands += 1
+                                    if subsection_addr - subsection_start_addr > g_max_voice_bytes:
+                                        raise Exception(f"Subsection at SPC address {hex(subsection_start_addr)} is longer than {hex(g_max_voice_bytes)} bytes")
+                                    if songset_commands > g_max_songset_commands:
+                                        raise Exception(f"Song set has more than {g_max_songset_commands} commands")
+                                    check_spc_read(spc_ram, subsection_addr, 1, f"Subsection at SPC address {hex(subsection_start_addr)}")
+                                    firstSubsectionNote = False
+                                if pianoroll_filename is not None:
+                                    repeat_count = spc_ram[addr+3] # 4th byte of command
+                                    if repeat_count == 0:
+                                        raise Exception(f"Subsection at SPC address {hex(subsection_start_addr)} has a repeat count of 0, which --pianoroll doesn't support")
+                                    songset_roll_entries += len(roll_subsection) * repeat_count
+                                    if songset_roll_entries > g_max_songset_roll_ticks:
+                                        raise Exception(f"Song set's piano roll is longer than {hex(g_max_songset_roll_ticks)} ticks")
+                                    # later passes start with the note length the previous pass ended with
+                                    later_pass = [(command, roll_note_length_tics, offset) for (command, _, offset) in roll_subsection[:roll_subsection_carried_in]] + \
+                                                 roll_subsection[roll_subsection_carried_in:]
+                                    roll_voice_section += roll_subsection + later_pass * (repeat_count - 1)
+                                addr += 4
+                                indent -= 1
+                                print('') # newline after last subsection note
+                                print(indentme(indent, "]}}"), end='') # end subsection, no newline, wait and see if comma is needed
                             else:
-                                wehaveSuppressedFirstComma = True
-                            print(indentme(indent, json.dumps(kindaJson)), end='') # no newline, wait and see if comma is needed
-                        addr += length
+                                # general case
+                                (kindaJson, length, state) = stateful_process_track_command(spc_ram, addr, state, decoder)
+                                if pianoroll_filename is not None:
+                                    if spc_ram[addr] >= 1 and spc_ram[addr] < 0x80:
+                                        roll_note_length_tics = spc_ram[addr]
+                                    elif kindaJson is not None:
+                                        roll_voice_section.append((spc_ram[addr], roll_note_length_tics,
+                                                                   rom_offset_from_spc_addr(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)))
+                                        songset_roll_entries += 1
+                                        if songset_roll_entries > g_max_songset_roll_ticks:
+                                            raise Exception(f"Song set's piano roll is longer than {hex(g_max_songset_roll_ticks)} ticks")
+                                if kindaJson is not None and "note" in kindaJson:
+                                    kindaJson["address"] = address_tuple(addr, spc_start_addr, rom_equiv_of_spc_start_addr, spc_engine_begin_romaddr)
+                                    if wehaveSuppressedFirstComma:
+                                        print(',')
+                                    else:
+                                        wehaveSuppressedFirstComma = True
+                                    print(indentme(indent, json.dumps(kindaJson)), end='') # no newline, wait and see if comma is needed
+                                addr += length
+                                songset_commands += 1
+                                if songset_commands > g_max_songset_commands:
+                                    raise Exception(f"Song set has more than {g_max_songset_commands} commands")
+
+
+                        roll_voice_sections[(i, voice_section_start_ptr)] = (roll_voice_section, roll_note_length_tics)
+                        print('') # newline after last note
+                        indent -= 1
+                        print(indentme(indent, "]")) # end of note array
+                        indent -= 1
 
+                    print(indentme(indent, "}")) # end of last section (in voice) (no comma)
+                    indent -= 1
+                    print(indentme(indent, "]")) # end of section array
+                    indent -= 1
 
-                print('') # newline after last note
+                print(indentme(indent, "}")) # end of last voice (in song) (no comma)
                 indent -= 1
-                print(indentme(indent, "]")) # end of note array
+                print(indentme(indent, "]")) # end voice array
                 indent -= 1
 
-            print(indentme(indent, "}")) # end of last section (in voice) (no comma)
+                if pianoroll_filename is not None:
+                    # line voices back up by section, in play order (reorganized lost which sections they share)
+                    roll_section_voices = [[roll_voice_sections.get((i, voice_ptr)) for (i, voice_ptr) in enumerate(songset_song_section_voice[song_ptr][song_section])]
+                                           for song_section in songset_song_section_order[song_ptr]]
+                    (roll_sections, song_roll_ticks) = piano_roll_sections(roll_section_voices, len(reorganized[song_ptr]),
+                                                                           g_max_songset_roll_ticks - songset_roll_ticks)
+                    songset_roll_ticks += song_roll_ticks
+                    (roll, romaddrs) = piano_roll_arrays(roll_sections, len(reorganized[song_ptr]))
+                    songset_pianorolls[f"song{myhex(songset_id, 2)}{myhex(song_id, 2)}"] = roll
+                    songset_pianorolls[f"song{myhex(songset_id, 2)}{myhex(song_id, 2)}_rom"] = romaddrs
+
+            print(indentme(indent, "}")) # end of last song (in set) (no comma)
             indent -= 1
-            print(indentme(indent, "]")) # end of section array
+            print(indentme(indent, "]")) # end song array
             indent -= 1
-
-        print(indentme(indent, "}")) # end of last voice (in song) (no comma)
-        indent -= 1
-        print(indentme(indent, "]")) # end voice array
-        indent -= 1
-
-    print(indentme(indent, "}")) # end of last song (in set) (no comma)
-    indent -= 1
-    print(indentme(indent, "]")) # end song array
-    indent -= 1
+    except Exception as e:
+        songset_errors.append(songset_error(songset_id, current_table_rom_addr, e))
+        indent = 1
+        current_table_rom_addr += 3 # move to next song set
+        continue
+    sys.stdout.write(songset_output.getvalue())
+    pianorolls.update(songset_pianorolls)
+    any_songset_printed = True
     current_table_rom_addr += 3 # move to next song set
 
-print(indentme(indent, "}")) # end of last song set (no comma)
-print("]") # end songsets
+if any_songset_printed:
+    print(indentme(indent, "}")) # end of last song set (no comma)
+print("],") # end songsets
+print('"songsetErrors": [') # song sets skipped because they couldn't be decoded
+for error_index, error in enumerate(songset_errors):
+    print(indentme(indent, json.dumps(error)) + ("," if error_index != len(songset_errors) - 1 else ""))
+print("]") # end songsetErrors
 print("}") # end json
+
+if pianoroll_filename is not None:
+    numpy.savez_compressed(pianoroll_filename, **pianorolls)